@@ -26,24 +26,48 @@
 import os.path
 
 import pwem
+from pyworkflow.object import Object
+from pyworkflow.utils import Environ
 
 
 __version__ = '3.2.1'
 _references = ["Turonova2017"]
 NOVACTF_HOME = 'NOVACTF_HOME'
+NOVACTF_PREFETCH = 'NOVACTF_PREFETCH'
+NOVACTF_SCRATCH = 'NOVACTF_SCRATCH'
 
 
 class Plugin(pwem.Plugin):
     _homeVar = NOVACTF_HOME
     _url = "https://github.com/scipion-em/scipion-em-novactf"
+    _program = None
 
     @classmethod
     def _defineVariables(cls):
         cls._defineEmVar(NOVACTF_HOME, 'novactf-master')
+        cls._defineVar(NOVACTF_PREFETCH, '0')
+        cls._defineVar(NOVACTF_SCRATCH, '')
 
     @classmethod
-    def getEnviron(cls):
-        return None
+    def getEnviron(cls, threads=1):
+        """ Setup the environment variables needed to launch novaCTF,
+        limiting it to the given number of OpenMP threads. """
+        environ = Environ(os.environ)
+        environ.update({'OMP_NUM_THREADS': str(threads)},
+                       position=Environ.REPLACE)
+        return environ
+
+    @classmethod
+    def usePrefetch(cls):
+        """ Whether to hint the kernel about input stacks that are about
+        to be read. """
+        return cls.getVar(NOVACTF_PREFETCH) == '1'
+
+    @classmethod
+    def getScratchDir(cls):
+        """ Local folder (e.g. /dev/shm) for the intermediate stacks,
+        or None to keep them in the protocol tmp folder. """
+        return cls.getVar(NOVACTF_SCRATCH) or None
 
     @classmethod
     def getDependencies(cls):
@@ -86,20 +110,44 @@ class Plugin(pwem.Plugin):
                        default=True)
 
     @classmethod
-    def runNovactf(cls, protocol, **kwargs):
-        """ Run NovaCTF command from a given protocol. """ 
+    def getProgram(cls):
+        """ Return the path to the novaCTF binary. It is resolved on the
+        first call only, protocols run it once per step. """
+        if cls._program is None:
+            novaCTF_home = cls.getVar(NOVACTF_HOME)
 
-        novaCTF_home = cls.getVar(NOVACTF_HOME)
+            # We test whether the NOVACTF_HOME variable provides a direct path to the novaCTF binary:
+            if os.path.isfile(os.path.join(novaCTF_home, "novaCTF")):
+                cls._program = os.path.join(novaCTF_home, "novaCTF")
 
-        # We test whether the NOVACTF_HOME variable provides a direct path to the novaCTF binary:
-        if os.path.isfile( novaCTF_home + "/novaCTF" ):
+            # If not, we expect it under the novaCTF-master folder:
+            else:
+                cls._program = os.path.join(novaCTF_home, "novaCTF-master", "novaCTF")
 
-            fullProgram = os.path.join(novaCTF_home, "novaCTF")
+        return cls._program
 
-        # If not, we expect it under the novaCTF-master folder:
-        else:
-
-            fullProgram = os.path.join(novaCTF_home, "novaCTF-master", "novaCTF")
-
-        args = ' '.join([f"{k} {v}" for k, v in kwargs.items()])
-        protocol.runJob(fullProgram, args, env=cls.getEnviron())
+    @classmethod
+    def runNovactf(cls, protocol, threads=1, **kwargs):
+        """ Run NovaCTF command from a given protocol. Protocols run one
+        novaCTF call per parallel step, so they decide how many of their
+        threads each call can use. """
+        protocol.runJob(cls.getProgram(), cls.formatArgs(kwargs),
+                        env=cls.getEnviron(threads))
+
+    @staticmethod
+    def formatArgs(params):
+        """ Flatten a {flag: value} dict into a command line argument string.
+        Flags with an empty value (e.g. IMOD switches) are passed alone.
+        Scipion params are passed by value and booleans as 1/0. """
+        argv = []
+        for flag, value in params.items():
+            if isinstance(value, Object):
+                value = value.get()
+            if isinstance(value, bool):
+                value = int(value)
+
+            argv.append(flag)
+            if value != "":
+                argv.append(str(value))
+
+        return " ".join(argv)
@@ -33,8 +33,10 @@ from pyworkflow.protocol.constants import STEPS_PARALLEL
 from pyworkflow.object import Integer, List
 from pwem.protocols import EMProtocol
 
+from imod import Plugin as imodPlugin
 from imod import utils as imodUtils
 from novactf import Plugin
+from novactf import utils
 
 
 class ProtNovaCtfDefocus(EMProtocol):
@@ -82,7 +84,8 @@ class ProtNovaCtfDefocus(EMProtocol):
             'defocusFn': self._getExtraPath("%(tsId)s/%(tsId)s.defocus"),
             'stackDefocusFn': self._getExtraPath("%(tsId)s/%(tsId)s.defocus_%(counter)d"),
             'defocusShiftFn': self._getExtraPath("%(tsId)s/%(tsId)s.def_shift"),
-            'tltFn': self._getTmpPath("%(tsId)s/%(tsId)s.tlt")
+            'tltFn': self._getTmpPath("%(tsId)s/%(tsId)s.tlt"),
+            'inputTsFn': self._getTmpPath("%(tsId)s/%(tsId)s.mrc")
         }
 
         self._updateFilenamesDict(myDict)
@@ -159,8 +162,13 @@ class ProtNovaCtfDefocus(EMProtocol):
         for ts in self.getInputTs().iterItems():
             tsId = ts.getTsId()
             objId = ts.getObjId()
-            self._insertFunctionStep(self.convertInputStep, objId, tsId)
-            self._insertFunctionStep(self.computeDefocusStep, objId, tsId)
+            # Tilt-series are independent, so each one only waits for its
+            # own conversion and they can be processed in parallel.
+            convertId = self._insertFunctionStep(self.convertInputStep,
+                                                 objId, tsId,
+                                                 prerequisites=[])
+            self._insertFunctionStep(self.computeDefocusStep, objId, tsId,
+                                     prerequisites=[convertId])
 
     # --------------------------- STEPS functions -----------------------------
     def convertInputStep(self, tsObjId, tsId):
@@ -170,15 +178,26 @@ class ProtNovaCtfDefocus(EMProtocol):
         path.makePath(self._getTmpPath(tsId))
         path.makePath(self._getExtraPath(tsId))
 
-        # Generate angle file
         with self._lock:
+            # Generate angle file
             ts = self.getInputTs()[tsObjId]
+            tsFn = ts.getFirstItem().getFileName()
             ts.generateTltFile(self._getFileName("tltFn", tsId=tsId))
 
-        # Generate defocus file
-        ctfTomoSeries = self.getCtfTomoSeriesFromTsId(tsId)
-        defocusFile = self._getFileName("defocusFn", tsId=tsId)
-        imodUtils.generateDefocusIMODFileFromObject(ctfTomoSeries, defocusFile)
+            # Generate defocus file
+            ctfTomoSeries = self.getCtfTomoSeriesFromTsId(tsId)
+            defocusFile = self._getFileName("defocusFn", tsId=tsId)
+            imodUtils.generateDefocusIMODFileFromObject(ctfTomoSeries, defocusFile)
+
+        # novaCTF only reads MRC stacks, convert other formats
+        if not utils.isMrcFile(tsFn):
+            paramsConvert = {
+                "-input": tsFn,
+                "-output": self._getFileName("inputTsFn", tsId=tsId),
+                "-mode": 2
+            }
+            imodPlugin.runImod(self, 'newstack',
+                               Plugin.formatArgs(paramsConvert))
 
     def computeDefocusStep(self, tsObjId, tsId):
         with self._lock:
@@ -186,6 +205,9 @@ class ProtNovaCtfDefocus(EMProtocol):
             firstItem = ts.getFirstItem()
             tsFn = firstItem.getFileName()
             xDim, yDim, _ = firstItem.getDim()
+            if not utils.isMrcFile(tsFn):
+                tsFn = self._getFileName("inputTsFn", tsId=tsId)
+            nTs = self.getInputTs().getSize()
 
         paramsDefocus = {
             '-Algorithm': "defocus",
@@ -209,12 +231,16 @@ class ProtNovaCtfDefocus(EMProtocol):
             with open(defocusShiftFile, "w") as fn:
                 fn.write(f"{defocusShift}")
 
-        Plugin.runNovactf(self, **paramsDefocus)
+        # Tilt-series are processed in parallel, so they share the threads
+        threads = max(1, self.numberOfThreads.get() // nTs)
+        Plugin.runNovactf(self, threads=threads, **paramsDefocus)
+        # The converted copy is not needed anymore
+        path.cleanPath(self._getFileName("inputTsFn", tsId=tsId))
 
         nstacks = self.getNumberOfStacks(tsId)
-        self.numberOfIntermediateStacks.append(Integer(nstacks))
-
-        self._store()
+        with self._lock:
+            self.numberOfIntermediateStacks.append(Integer(nstacks))
+            self._store()
 
     # --------------------------- INFO functions ------------------------------
     def _validate(self):
@@ -23,14 +23,19 @@
 # *  e-mail address 'scipion@cnb.csic.es'
 # *
 # *****************************************************************************
+import hashlib
+import json
 import os
+import shutil
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 from pyworkflow.constants import PROD
-from pyworkflow.object import Set
+from pyworkflow.object import Set, String
 import pyworkflow.protocol.params as params
 import pyworkflow.utils.path as path
-from pyworkflow.protocol.constants import STEPS_PARALLEL
+from pyworkflow.protocol.constants import STEPS_PARALLEL, MODE_RESTART
 from pwem.protocols import EMProtocol
 from tomo.protocols import ProtTomoBase
 from tomo.objects import SetOfTomograms, Tomogram
@@ -38,6 +43,11 @@ from tomo.objects import SetOfTomograms, Tomogram
 from imod import Plugin as imodPlugin
 from imod import utils as imodUtils
 from novactf import Plugin
+from novactf import utils
+
+
+# Number of tilt-series that can be prepared ahead of the reconstructions
+CONVERT_LOOKAHEAD = 2
 
 
 class outputs(Enum):
@@ -81,24 +91,75 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
     def __init__(self, **args):
         EMProtocol.__init__(self, **args)
         self.stepsExecutionMode = STEPS_PARALLEL
+        # Inputs resolved once per execution. A plain dict, so Scipion
+        # does not try to store the cached objects as protocol attributes
+        self._inputs = {}
+        # Scratch folder chosen by the first execution ('' for none). It is
+        # stored, so continued runs keep their intermediate stacks in the
+        # same place even if the free space has changed meanwhile
+        self._scratchFolder = String()
+        self._scratchPath = None
 
     def _initialize(self):
+        inputProt = self.protNovaCtfDefocus.get()
+        inputProt._createFilenameTemplates()
+        inputTs = inputProt.inputSetOfTiltSeries.get()
+        self._inputs = {
+            'prot': inputProt,
+            'ts': inputTs,
+            'acquisition': inputTs.getAcquisition(),
+            'samplingRate': inputTs.getSamplingRate()
+        }
+
+        if self.runMode.get() == MODE_RESTART and self._scratchFolder.get():
+            path.cleanPath(self._scratchFolder.get())
+        if self._scratchFolder.get() is None or self.runMode.get() == MODE_RESTART:
+            self._scratchFolder.set(self._getScratchPath() or '')
+            self._store(self._scratchFolder)
+        self._scratchPath = self._scratchFolder.get() or None
         self._createFilenameTemplates()
+        self._tsMeta = {}
+
+        # Values shared by every intermediate stack, resolved only once
+        acq = self.getInputAcquisition()
+        self._ctfCorrectionParams = {
+            '-CorrectionType': self.getCorrectionType(),
+            '-DefocusFileFormat': "imod",
+            '-CorrectAstigmatism': 1 if inputProt.correctAstigmatism else 0,
+            '-PixelSize': self.getInputSamplingRate() / 10,
+            '-AmplitudeContrast': acq.getAmplitudeContrast(),
+            '-Cs': acq.getSphericalAberration(),
+            '-Volt': acq.getVoltage()
+        }
+        self._radialParams = (f"{self.radialFirstParameter.get()},"
+                              f"{self.radialSecondParameter.get()}")
+
+        # The protocol is stored every few tomograms, not after each one
+        self._storeInterval = max(1, self.getInputTs().getSize() // 20)
+        self._pendingStores = 0
+        # At most two folders are deleted at a time, so the removal of big
+        # stacks does not saturate the disk used by running steps
+        self._cleanupPool = ThreadPoolExecutor(max_workers=2)
+        self._cleanupFutures = []
+        # Steps currently running, to share the threads among them
+        self._runningSteps = 0
 
     def _createFilenameTemplates(self):
         """ Centralize how files are called. """
         tmpPath = lambda p: self._getTmpPath("%(tsId)s", "%(tsId)s" + p)
+        stackPath = lambda p: self._getStackPath("%(tsId)s", "%(tsId)s" + p)
         myDict = {
             'tltFn': tmpPath(".tlt"),
             'xfFn': tmpPath(".xf"),
+            'metaFn': tmpPath("_meta.json"),
             'inputTsFn': tmpPath(".mrc"),
-            'stackTsFn': tmpPath(".mrc_%(counter)d"),
-            'stackAliFn': tmpPath("_ali.mrc_%(counter)d"),
-            'stackEraseFn': tmpPath("_erase.mrc_%(counter)d"),
+            'stackTsFn': stackPath(".mrc_%(counter)d"),
+            'stackAliFn': stackPath("_ali.mrc_%(counter)d"),
+            'stackEraseFn': stackPath("_erase.mrc_%(counter)d"),
             'eraseFidFn': tmpPath("_erase.fid"),
-            'stackFlipFn': tmpPath("_flip.mrc_%(counter)d"),
-            'stackFilterFn': tmpPath("_filter.mrc_%(counter)d"),
-            'filterFn': tmpPath("_filter.mrc"),
+            'stackFlipFn': stackPath("_flip.mrc_%(counter)d"),
+            'stackFilterFn': stackPath("_filter.mrc_%(counter)d"),
+            'filterFn': stackPath("_filter.mrc"),
             'recFn': tmpPath("_rec.mrc"),
             'outputTsFn': self._getExtraPath("%(tsId)s", "%(tsId)s.mrc"),
         }
@@ -155,22 +216,53 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
                            "value to apply to all objects or a "
                            "value for each object.")
 
+        form.addParam('scratchDir', params.PathParam,
+                      default='',
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Scratch folder',
+                      help='Local folder (e.g. /dev/shm or a local NVMe disk) '
+                           'where the intermediate stacks are written. If '
+                           'empty, the NOVACTF_SCRATCH variable is used, and '
+                           'if that is not set either, the protocol tmp '
+                           'folder. The tmp folder is also used if the '
+                           'scratch folder is too small.\n'
+                           'The folder is chosen when the run starts: '
+                           'changing it and continuing the run has no effect, '
+                           'restart the run to use a different one.')
+
         form.addParallelSection(threads=8)
 
     # -------------------------- INSERT steps functions -----------------------
     def _insertAllSteps(self):
         self._initialize()
         allCreateOutputId = []
-        nstacks = self.getInputProt().numberOfIntermediateStacks
+        inputProt = self.getInputProt()
 
-        for index, ts in enumerate(self.getInputTs().iterItems()):
-            tsId = ts.getTsId()
-            objId = ts.getObjId()
+        tsRows = [(ts.getObjId(), ts.getTsId())
+                  for ts in self.getInputTs().iterItems()]
+        # Defocus steps may finish in any order, so the number of
+        # stacks is looked up per tilt-series instead of by position
+        nstacks = [inputProt.getNumberOfStacks(tsId) for _, tsId in tsRows]
+        tsIds = [tsId for _, tsId in tsRows]
+        self._nextTsId = dict(zip(tsIds, tsIds[1:]))
+
+        # A tilt-series is converted once the one CONVERT_LOOKAHEAD
+        # positions before it has been reconstructed (by default a step
+        # waits for the previous one). This way the next tilt-series are
+        # prepared while earlier ones are reconstructed, but only a few
+        # converted copies and intermediate stacks exist at the same time.
+        reconstructIds = []
+        for i, ((objId, tsId), tsNstacks) in enumerate(zip(tsRows, nstacks)):
+            if i < CONVERT_LOOKAHEAD:
+                convertDeps = []
+            else:
+                convertDeps = [reconstructIds[i - CONVERT_LOOKAHEAD]]
             convertInputId = self._insertFunctionStep(self.convertInputStep,
-                                                      objId, tsId)
+                                                      objId, tsId,
+                                                      prerequisites=convertDeps)
 
             intermediateStacksId = []
-            for counter in range(nstacks[index].get()):
+            for counter in range(tsNstacks):
                 ctfId = self._insertFunctionStep(self.processIntermediateStacksStep,
                                                  objId, tsId, counter,
                                                  prerequisites=[convertInputId])
@@ -178,8 +270,9 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
 
             reconstructId = self._insertFunctionStep(self.computeReconstructionStep,
                                                      objId, tsId,
-                                                     nstacks[index].get(),
+                                                     tsNstacks,
                                                      prerequisites=intermediateStacksId)
+            reconstructIds.append(reconstructId)
 
             createOutputId = self._insertFunctionStep(self.createOutputStep,
                                                       objId, tsId,
@@ -193,6 +286,7 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
     def convertInputStep(self, tsObjId, tsId):
         # Create the folders for the tilt series
         path.makePath(self._getTmpPath(tsId))
+        path.makePath(self._getStackPath(tsId))
         path.makePath(self._getExtraPath(tsId))
 
         with self._lock:
@@ -200,7 +294,8 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
             firstItem = ts.getFirstItem()
             tsFn = firstItem.getFileName()
 
-            if firstItem.hasTransform():
+            hasTransform = firstItem.hasTransform()
+            if hasTransform:
                 # Generate transformation matrices file
                 outputTmFile = self._getFileName("xfFn", tsId=tsId)
                 imodUtils.genXfFile(ts, outputTmFile)
@@ -208,71 +303,95 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
             # Generate angle file
             ts.generateTltFile(self._getFileName("tltFn", tsId=tsId))
 
-        # Link tilt series file
-        path.createLink(tsFn,
-                        self._getFileName("inputTsFn", tsId=tsId))
+            xDim, yDim, _ = firstItem.getDim()
+            rotationAngle = ts.getAcquisition().getTiltAxisAngle()
+            tsMeta = {
+                'xDim': xDim,
+                'yDim': yDim,
+                # Check if rotation angle is greater than 45º.
+                # If so, x and y dimensions are swapped to adapt output
+                # image sizes to the final sample disposition.
+                'swapXY': 45 < abs(rotationAngle) < 135,
+                'applyAlignment': ts.hasAlignment()
+            }
+
+        # Applying identity transforms with no size change just rewrites
+        # every intermediate stack, so the alignment step is skipped
+        if (tsMeta['applyAlignment'] and hasTransform and
+                not tsMeta['swapXY'] and utils.isIdentityXf(outputTmFile)):
+            tsMeta['applyAlignment'] = False
+
+        # Store the values needed by the following steps, so they do not
+        # have to query the input set under the lock
+        with open(self._getFileName("metaFn", tsId=tsId), "w") as fn:
+            json.dump(tsMeta, fn)
+        self._tsMeta[tsId] = tsMeta
+
+        # Link tilt series file if novaCTF can read it directly,
+        # otherwise convert it once to a float32 MRC
+        inputTsFn = self._getFileName("inputTsFn", tsId=tsId)
+        if utils.isMrcFile(tsFn):
+            path.createLink(tsFn, inputTsFn)
+        else:
+            imodPlugin.runImod(self, 'newstack',
+                               Plugin.formatArgs({"-input": tsFn,
+                                                  "-output": inputTsFn,
+                                                  "-mode": 2}))
 
     def processIntermediateStacksStep(self, tsObjId, tsId, counter):
-        self.info(f"Processing {tsId}, intermediate stack #{counter}")
-        inputProt = self.getInputProt()
-        inputProt._createFilenameTemplates()
-        defocusFn = inputProt._getFileName("stackDefocusFn",
-                                           tsId=tsId, counter=counter)
+        with self._countRunningStep(), self._cleanStackOnError(tsId, counter):
+            self._processIntermediateStack(tsId, counter)
 
-        with self._lock:
-            ts = self.getInputTs()[tsObjId]
-            rotationAngle = ts.getAcquisition().getTiltAxisAngle()
-            firstItem = ts.getFirstItem()
-            xDim, yDim, _ = firstItem.getDim()
-            hasTransform = firstItem.hasTransform()
+    def _processIntermediateStack(self, tsId, counter):
+        self.info(f"Processing {tsId}, intermediate stack #{counter}")
+        path.makePath(self._getStackPath(tsId))
+        defocusFn = self.getInputProt()._getFileName("stackDefocusFn",
+                                                     tsId=tsId,
+                                                     counter=counter)
+        tltFn = self._getFileName("tltFn", tsId=tsId)
+        stackTsFn = self._getFileName("stackTsFn", tsId=tsId, counter=counter)
+        stackAliFn = self._getFileName("stackAliFn", tsId=tsId, counter=counter)
+        stackFlipFn = self._getFileName("stackFlipFn", tsId=tsId, counter=counter)
+
+        tsMeta = self.getTsMeta(tsId)
+        xDim, yDim = tsMeta['xDim'], tsMeta['yDim']
 
         # ---------- CTF correction step --------------------------------------
         paramsCtfCorrection = {
             '-Algorithm': "ctfCorrection",
             '-InputProjections': self._getFileName("inputTsFn", tsId=tsId),
-            '-OutputFile': self._getFileName("stackTsFn",
-                                             tsId=tsId, counter=counter),
+            '-OutputFile': stackTsFn,
             '-DefocusFile': defocusFn,
-            '-TILTFILE': self._getFileName("tltFn", tsId=tsId),
-            '-CorrectionType': self.getCorrectionType(),
-            '-DefocusFileFormat': "imod",
-            '-CorrectAstigmatism': 1 if inputProt.correctAstigmatism else 0,
-            '-PixelSize': self.getInputSamplingRate() / 10,
-            '-AmplitudeContrast':
-                self.getInputAcquisition().getAmplitudeContrast(),
-            '-Cs':
-                self.getInputAcquisition().getSphericalAberration(),
-            '-Volt': self.getInputAcquisition().getVoltage()
+            '-TILTFILE': tltFn,
+            **self._ctfCorrectionParams
         }
 
-        Plugin.runNovactf(self, **paramsCtfCorrection)
+        Plugin.runNovactf(self, threads=self._getStepThreads(),
+                          **paramsCtfCorrection)
 
-        currentFn = self._getFileName("stackTsFn",
-                                      tsId=tsId, counter=counter)
+        currentFn = stackTsFn
 
         # --------- Alignment step --------------------------------------------
-        if ts.hasAlignment():
+        if tsMeta['applyAlignment']:
             paramsAlignment = {
                 "-input": currentFn,
-                "-output": self._getFileName("stackAliFn",
-                                             tsId=tsId, counter=counter),
+                "-output": stackAliFn,
                 "-xform": self._getFileName("xfFn", tsId=tsId),
                 "-AdjustOrigin": "",
                 "-NearestNeighbor": "",
                 "-taper": "1,1"
             }
 
-            # Check if rotation angle is greater than 45º.
-            # If so, swap x and y dimensions to adapt output image
-            # sizes to the final sample disposition.
-            if 45 < abs(rotationAngle) < 135:
+            if tsMeta['swapXY']:
                 paramsAlignment['-size'] = f"{yDim},{xDim}"
 
-            args = ' '.join([f"{k} {v}" for k, v in paramsAlignment.items()])
-            imodPlugin.runImod(self, 'newstack', args)
+            imodPlugin.runImod(self, 'newstack',
+                               Plugin.formatArgs(paramsAlignment))
 
-            currentFn = self._getFileName("stackAliFn",
-                                          tsId=tsId, counter=counter)
+            # Each intermediate file is removed as soon as it is consumed
+            path.cleanPath(currentFn)
+
+            currentFn = stackAliFn
 
         # ---------- Erase gold step ------------------------------------------
         #TODO: There used to be an erase gold beads steps, but it was removed
@@ -281,11 +400,12 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
         flipArgs = [
             "flipyz",
             currentFn,
-            self._getFileName("stackFlipFn", tsId=tsId, counter=counter)
+            stackFlipFn
         ]
         imodPlugin.runImod(self, 'clip', " ".join(flipArgs))
+        path.cleanPath(currentFn)
 
-        currentFn = self._getFileName("stackFlipFn", tsId=tsId, counter=counter)
+        currentFn = stackFlipFn
 
         # ------------- Filtering step ----------------------------------------
         paramsFilter = {
@@ -293,26 +413,36 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
             "-InputProjections": currentFn,
             "-OutputFile": self._getFileName("stackFilterFn",
                                              tsId=tsId, counter=counter),
-            "-TILTFILE": self._getFileName("tltFn", tsId=tsId),
+            "-TILTFILE": tltFn,
             "-StackOrientation": "xz",
-            "-RADIAL":
-                f"{self.radialFirstParameter.get()},{self.radialSecondParameter.get()}"
+            "-RADIAL": self._radialParams
         }
 
-        Plugin.runNovactf(self, **paramsFilter)
+        Plugin.runNovactf(self, threads=self._getStepThreads(),
+                          **paramsFilter)
+        path.cleanPath(currentFn)
 
     def computeReconstructionStep(self, tsObjId, tsId, nstacks):
-        with self._lock:
-            ts = self.getInputTs()[tsObjId]
-            firstItem = ts.getFirstItem()
-            xDim, yDim, _ = firstItem.getDim()
-            rotationAngle = ts.getAcquisition().getTiltAxisAngle()
+        with self._countRunningStep():
+            self._computeReconstruction(tsId, nstacks)
+
+    def _computeReconstruction(self, tsId, nstacks):
+        # Filtered stacks lost since they were computed (e.g. with a
+        # wiped ramdisk when continuing a run) are computed again
+        for counter in range(nstacks):
+            if not os.path.exists(self._getFileName("stackFilterFn",
+                                                    tsId=tsId, counter=counter)):
+                self._processIntermediateStack(tsId, counter)
+
+        recFn = self._getFileName("recFn", tsId=tsId)
+        tsMeta = self.getTsMeta(tsId)
+        xDim, yDim = tsMeta['xDim'], tsMeta['yDim']
 
         # ----------- 3D CTF step ---------------------------------------------
         params3dctf = {
             "-Algorithm": "3dctf",
             "-InputProjections": self._getFileName("filterFn", tsId=tsId),
-            "-OutputFile": self._getFileName("recFn", tsId=tsId),
+            "-OutputFile": recFn,
             "-FULLIMAGE": f"{xDim},{yDim}",
             "-TILTFILE": self._getFileName("tltFn", tsId=tsId),
             "-THICKNESS": self.getInputProt().tomoThickness,
@@ -322,51 +452,87 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
             "-Use3DCTF": 1
         }
 
-        # Check if rotation angle is greater than 45º.
-        # If so, swap x and y dimensions to adapt output image
-        # sizes to the final sample disposition.
-        if 45 < abs(rotationAngle) < 135:
+        if tsMeta['swapXY']:
             params3dctf['-FULLIMAGE'] = f"{yDim},{xDim}"
 
-        Plugin.runNovactf(self, **params3dctf)
+        # 3dctf does not read the input stack, so meanwhile the next
+        # tilt-series (read once per intermediate stack) is loaded in cache
+        nextTsId = self._nextTsId.get(tsId)
+        if nextTsId and Plugin.usePrefetch():
+            utils.prefetchFile(self._getFileName("inputTsFn", tsId=nextTsId))
+
+        Plugin.runNovactf(self, threads=self._getStepThreads(), **params3dctf)
 
         # ---------- Trim vol - rotate around X -------------------------------
-        inputFn = self._getFileName("recFn", tsId=tsId)
         outputFn = self._getFileName("outputTsFn", tsId=tsId)
         imodPlugin.runImod(self, 'trimvol',
-                           " ".join(["-rx", inputFn, outputFn]))
+                           " ".join(["-rx", recFn, outputFn]))
 
-        # Remove intermediate files. Necessary for big sets of tilt-series
+        # Remove intermediate files. Necessary for big sets of tilt-series.
+        # Done in the background so the next steps do not wait for it.
         if os.path.exists(outputFn):
-            path.cleanPath(self._getTmpPath(tsId))
+            cleanup = self._cleanupPool.submit(path.cleanPath,
+                                               self._getTmpPath(tsId),
+                                               self._getStackPath(tsId))
+            with self._lock:
+                self._cleanupFutures.append(cleanup)
 
     def createOutputStep(self, tsObjId, tsId):
-        with self._lock:
-            ts = self.getInputTs()[tsObjId]
-            acq = ts.getAcquisition()
-
-        outputTomos = self.getOutputSetOfTomograms()
         outputFn = self._getFileName("outputTsFn", tsId=tsId)
 
         if os.path.exists(outputFn):
-            newTomogram = Tomogram()
-            newTomogram.setLocation(outputFn)
-            newTomogram.setTsId(tsId)
-            newTomogram.setSamplingRate(self.getInputSamplingRate())
+            # Appends from parallel steps share the output set (and its
+            # sqlite connection), so they are serialized. Each append is
+            # committed right away, so a later failure does not lose it,
+            # but the protocol is only stored every few tomograms.
+            with self._lock:
+                ts = self.getInputTs()[tsObjId]
+                acq = ts.getAcquisition()
+                outputTomos = self.getOutputSetOfTomograms()
+
+                newTomogram = Tomogram()
+                newTomogram.setLocation(outputFn)
+                newTomogram.setTsId(tsId)
+                newTomogram.setSamplingRate(self.getInputSamplingRate())
+
+                # Set default tomogram origin
+                newTomogram.setOrigin(newOrigin=None)
+                newTomogram.setAcquisition(acq)
+
+                outputTomos.append(newTomogram)
+                outputTomos.write()
+                self._pendingStores += 1
+
+                if self._pendingStores >= self._storeInterval:
+                    self._store()
+                    self._pendingStores = 0
 
-            # Set default tomogram origin
-            newTomogram.setOrigin(newOrigin=None)
-            newTomogram.setAcquisition(acq)
+    def closeOutputSetsStep(self):
+        # A failed removal is only reported, the tomograms are already done
+        for cleanup in self._cleanupFutures:
+            error = cleanup.exception()
+            if error is not None:
+                self.warning(f"Intermediate files could not be removed: {error}")
+        self._cleanupPool.shutdown()
 
-            outputTomos.append(newTomogram)
-            outputTomos.write()
-            self._store()
+        if self._scratchPath:
+            path.cleanPath(self._scratchPath)
 
-    def closeOutputSetsStep(self):
-        self.getOutputSetOfTomograms().setStreamState(Set.STREAM_CLOSED)
+        outputTomos = self.getOutputSetOfTomograms()
+        outputTomos.setStreamState(Set.STREAM_CLOSED)
+        outputTomos.write()
         self._store()
 
     # --------------------------- INFO functions ------------------------------
+    def _validate(self):
+        validateMsgs = []
+
+        scratchDir = self.scratchDir.get()
+        if scratchDir and not os.path.isdir(scratchDir):
+            validateMsgs.append(f"Scratch folder {scratchDir} does not exist.")
+
+        return validateMsgs
+
     def _warnings(self):
         warningMsgs = []
         ts = self.getInputTs()
@@ -417,16 +583,100 @@ class ProtNovaCtfReconstruction(EMProtocol, ProtTomoBase):
     def getInputTs(self, pointer=False):
         if pointer:
             return self.getInputProt().inputSetOfTiltSeries
+        elif 'ts' in self._inputs:
+            return self._inputs['ts']
         else:
             return self.getInputProt().inputSetOfTiltSeries.get()
 
+    def _getScratchPath(self):
+        """ Return this run's folder under the scratch folder, or None if
+        none is set or the scratch disk cannot hold the intermediate
+        stacks. novaCTF writes them as float32, one filtered stack per
+        defocus plane for each tilt-series in progress, plus the two
+        stacks in flight of every running step. """
+        scratchDir = self.scratchDir.get() or Plugin.getScratchDir()
+        if scratchDir is None or not os.path.isdir(scratchDir):
+            return None
+
+        inputTs = self.getInputTs()
+        xDim, yDim, _ = inputTs.getFirstItem().getFirstItem().getDim()
+        nTilts = max(ts.getSize() for ts in inputTs.iterItems())
+        stackBytes = xDim * yDim * nTilts * 4
+        nstacks = max([n.get() for n in
+                       self.getInputProt().numberOfIntermediateStacks] or [0])
+        concurrentTs = min(inputTs.getSize(), CONVERT_LOOKAHEAD + 1)
+        requiredBytes = stackBytes * (concurrentTs * nstacks +
+                                      2 * self.numberOfThreads.get())
+
+        if shutil.disk_usage(scratchDir).free < requiredBytes:
+            self.info(f"Not enough space in {scratchDir} for the intermediate "
+                      "stacks, using the protocol tmp folder instead.")
+            return None
+
+        # Deterministic name, so continued runs find their files again
+        runHash = hashlib.md5(
+            os.path.abspath(self._getTmpPath()).encode()).hexdigest()[:8]
+        return os.path.join(scratchDir, f"scipion_novactf_{runHash}")
+
+    @contextmanager
+    def _countRunningStep(self):
+        """ Keep track of the number of steps running in parallel. """
+        with self._lock:
+            self._runningSteps += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._runningSteps -= 1
+
+    def _getStepThreads(self):
+        """ Threads for a novaCTF call, sharing numberOfThreads among the
+        steps running at the moment. """
+        with self._lock:
+            return max(1, self.numberOfThreads.get() // max(1, self._runningSteps))
+
+    @contextmanager
+    def _cleanStackOnError(self, tsId, counter):
+        """ Remove the files of one intermediate stack if its step fails,
+        so a failed run does not keep them (e.g. in RAM for /dev/shm).
+        Other stacks of the tilt-series are left for the running steps. """
+        try:
+            yield
+        except Exception:
+            path.cleanPath(*[self._getFileName(key, tsId=tsId, counter=counter)
+                             for key in ['stackTsFn', 'stackAliFn',
+                                         'stackFlipFn', 'stackFilterFn']])
+            raise
+
+    def _getStackPath(self, *paths):
+        """ Path for the intermediate stacks, in scratch if available. """
+        if self._scratchPath:
+            return os.path.join(self._scratchPath, *paths)
+
+        return self._getTmpPath(*paths)
+
+    def getTsMeta(self, tsId):
+        """ Return the tilt-series values stored by convertInputStep. They
+        are read from disk only if the run was continued after it. """
+        if tsId not in self._tsMeta:
+            with open(self._getFileName("metaFn", tsId=tsId)) as fn:
+                self._tsMeta[tsId] = json.load(fn)
+
+        return self._tsMeta[tsId]
+
     def getInputProt(self):
+        if 'prot' in self._inputs:
+            return self._inputs['prot']
         return self.protNovaCtfDefocus.get()
 
     def getInputSamplingRate(self):
+        if 'samplingRate' in self._inputs:
+            return self._inputs['samplingRate']
         return self.getInputTs().getSamplingRate()
 
     def getInputAcquisition(self):
+        if 'acquisition' in self._inputs:
+            return self._inputs['acquisition']
         return self.getInputTs().getAcquisition()
 
     def getCorrectionType(self):
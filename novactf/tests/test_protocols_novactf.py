@@ -25,9 +25,10 @@
 # *****************************************************************************
 import os
 
+import mrcfile
+
 from pyworkflow.tests import setupTestProject, BaseTest, DataSet
 from pyworkflow.utils import magentaStr
-from pwem.emlib.image import ImageHandler
 import tomo.protocols
 import imod.protocols
 
@@ -144,7 +145,14 @@ class TestNovaCtfReconstructionWorkflow(TestNovaCtfBase):
         output = getattr(self.protReconstruct, outputName)
         self.assertIsNotNone(output)
         self.assertTrue(output.getSize() == 1)
+        self.assertEqual(output.getDim(), (960, 928, 20))
+
+        dims = self._getMrcDimensions(output.getFirstItem().getFileName())
+        self.assertEqual(dims, (960, 928, 20))
 
-        ih = ImageHandler()
-        self.assertTrue(
-            ih.getDimensions(output.getFirstItem()) == (960, 928, 20, 1))
+    @staticmethod
+    def _getMrcDimensions(fileName):
+        """ Read the dimensions from the mrc header only. """
+        with mrcfile.open(fileName, mode='r', permissive=True, header_only=True) as mrc:
+            header = mrc.header
+            return int(header.nx), int(header.ny), int(header.nz)
@@ -0,0 +1,84 @@
+# *****************************************************************************
+#
+# * Authors:     Federico P. de Isidro Gomez (fp.deisidro@cnb.csic.es) [1]
+# *
+# * [1] Centro Nacional de Biotecnologia, CSIC, Spain
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# *****************************************************************************
+import os
+import tempfile
+import unittest
+
+from pyworkflow.object import Boolean, Integer
+
+from .. import Plugin, utils
+
+
+class TestIsIdentityXf(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.xfFn = os.path.join(self.tmpDir.name, "ts.xf")
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def _writeXf(self, lines):
+        with open(self.xfFn, "w") as xf:
+            xf.write("\n".join(lines) + "\n")
+
+    def test_identity(self):
+        self._writeXf(["1.0 0.0 0.0 1.0 0.0 0.0"] * 3)
+        self.assertTrue(utils.isIdentityXf(self.xfFn))
+
+    def test_shift(self):
+        self._writeXf(["1.0 0.0 0.0 1.0 0.0 0.0",
+                       "1.0 0.0 0.0 1.0 2.5 0.0"])
+        self.assertFalse(utils.isIdentityXf(self.xfFn))
+
+    def test_shiftWithinTolerance(self):
+        self._writeXf(["1.0 0.0 0.0 1.0 0.00001 -0.00001"])
+        self.assertTrue(utils.isIdentityXf(self.xfFn))
+
+    def test_blankLines(self):
+        self._writeXf(["1.0 0.0 0.0 1.0 0.0 0.0", "",
+                       "   ", "1.0 0.0 0.0 1.0 0.0 0.0"])
+        self.assertTrue(utils.isIdentityXf(self.xfFn))
+
+    def test_shortLine(self):
+        self._writeXf(["1.0 0.0 0.0 1.0"])
+        self.assertFalse(utils.isIdentityXf(self.xfFn))
+
+
+class TestFormatArgs(unittest.TestCase):
+    def test_switchWithoutValue(self):
+        args = Plugin.formatArgs({"-input": "in.mrc", "-AdjustOrigin": "",
+                                  "-output": "out.mrc"})
+        self.assertEqual(args, "-input in.mrc -AdjustOrigin -output out.mrc")
+
+    def test_zeroValue(self):
+        self.assertEqual(Plugin.formatArgs({"-SHIFT": 0, "-Use3DCTF": 0.0}),
+                         "-SHIFT 0 -Use3DCTF 0.0")
+
+    def test_scipionParams(self):
+        args = Plugin.formatArgs({"-THICKNESS": Integer(400),
+                                  "-CorrectAstigmatism": Boolean(True),
+                                  "-Flag": Boolean(False)})
+        self.assertEqual(args, "-THICKNESS 400 -CorrectAstigmatism 1 -Flag 0")
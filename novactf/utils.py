@@ -0,0 +1,70 @@
+# *****************************************************************************
+# *
+# * Authors:     Federico P. de Isidro Gomez (fp.deisidro@cnb.csic.es) [1]
+# *
+# * [1] Centro Nacional de Biotecnologia, CSIC, Spain
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# *****************************************************************************
+"""
+This module contains utils functions shared by the novaCTF protocols.
+"""
+
+import os
+
+# Input stacks with these extensions are read directly by novaCTF,
+# anything else has to be converted to MRC first
+MRC_EXTENSIONS = ['.mrc', '.mrcs', '.st', '.ali']
+
+
+def isMrcFile(fileName):
+    """ Check if novaCTF can read the stack without converting it. """
+    return os.path.splitext(fileName)[1].lower() in MRC_EXTENSIONS
+
+
+def prefetchFile(fileName):
+    """ Ask the kernel to start reading the file into the page cache. This
+    is a no-op on platforms without posix_fadvise or if the file does not
+    exist. """
+    if not hasattr(os, "posix_fadvise") or not os.path.exists(fileName):
+        return
+
+    fd = os.open(fileName, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def isIdentityXf(xfFileName, tolerance=1e-4):
+    """ Check if every transformation in an IMOD .xf file is the identity
+    (unit rotation matrix and no shifts). """
+    identity = [1, 0, 0, 1, 0, 0]
+    with open(xfFileName) as xf:
+        for line in xf:
+            values = [float(v) for v in line.split()]
+            if not values:
+                continue
+            if len(values) != len(identity):
+                return False
+            if any(abs(v - i) > tolerance for v, i in zip(values, identity)):
+                return False
+
+    return True